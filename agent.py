@@ -1,87 +1,491 @@
-from typing import List, Dict, Tuple, Optional, Any
+from typing import List, Dict, Tuple, Optional, Any, Callable, Awaitable
 import anthropic
+from anthropic import AsyncAnthropic
 from pathlib import Path
 import os
-import json
-from config import SYSTEM_PROMPT, TOOLS_SCHEMA
+import importlib.util
+import orjson
+import time
+import sqlite3
+import asyncio
+import concurrent.futures
+import weakref
+from collections import deque
+from config import MODEL, SYSTEM_BLOCKS, TOOLS_SCHEMA_FROZEN, SUMMARY_MODEL, SUMMARY_PROMPT, EMBEDDING_MODEL
 from tools.file_ops import read_file
 
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Seconds to coalesce history writes before flushing them in one transaction
+HISTORY_FLUSH_DELAY = 0.25
+
+# Retention weight per role when trimming history to the byte budget; stored history
+# only holds user inputs and final answers, tool rounds are never persisted
+HISTORY_WEIGHTS = {"user": 2.0, "assistant": 1.0}
+
+# Bonus given to the newest message over the oldest when ranking history by relevance
+RECENCY_WEIGHT = 0.1
+
+# Built from the SDK's own Limits type so this works with whichever HTTP library
+# (httpx or httpx2) the installed anthropic release is based on
+_POOL_LIMITS = type(anthropic.DEFAULT_CONNECTION_LIMITS)(
+    max_keepalive_connections=20, max_connections=20, keepalive_expiry=60.0
+)
+
+# One pool per event loop: an async client's connections belong to the loop that opened them
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, anthropic.DefaultAsyncHttpxClient]" = weakref.WeakKeyDictionary()
+
+# Parsed history per database file, reused by later agents while the files on disk are unchanged
+_HISTORY_CACHE: Dict[str, Tuple[Tuple, int, List[Dict], Optional[str], int]] = {}
+
+def get_http_client() -> anthropic.DefaultAsyncHttpxClient:
+    # One keep-alive pool shared by every agent on this loop so consecutive API calls reuse connections
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = anthropic.DefaultAsyncHttpxClient(
+            limits=_POOL_LIMITS,
+            http2=importlib.util.find_spec("h2") is not None
+        )
+        _http_clients[loop] = client
+    return client
+
+async def close_http_client():
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
 class CodingAgent:
-    def __init__(self, api_key: str, working_directory: str = ".", history_file: str = "agent_history.json"):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    def __init__(self, api_key: str, working_directory: str = ".", history_file: str = "agent_history.db",
+                 history_window: int = 200, verbose: bool = False):
+        self.api_key = api_key
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[anthropic.DefaultAsyncHttpxClient, AsyncAnthropic]]" = (
+            weakref.WeakKeyDictionary()
+        )
         self.working_directory = Path(working_directory).resolve()
         self.history_file = history_file
-        self.messages: List[Dict] = []
+        self.history_window = history_window
+        # Echo streamed text and tool activity to stdout; off by default so callers only
+        # get the final response returned by process_message
+        self.verbose = verbose
+        # Hot window of recent messages; the full history stays in the database
+        self.messages: deque = deque(maxlen=history_window)
+        self.summary: Optional[str] = None
+        # Id of the last message folded into self.summary
+        self.summarized_up_to: int = 0
+        # After a failed summary, don't retry until history reaches this message id
+        self._summary_retry_id: int = 0
+        self._tool_concurrency = int(os.getenv("TOOL_CONCURRENCY_LIMIT", "8"))
+        self._tool_sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._tool_concurrency)
+        # Single worker so history writes land on disk in the order they were issued
+        self._history_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Messages added since the last flush; written together at most every HISTORY_FLUSH_DELAY
+        self._pending: List[Dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Message id -> normalized embedding, filled lazily when history is ranked by relevance
+        self._embeddings: Dict[int, Any] = {}
+        self._embedder = None
+        # Implement other tools by adding handlers here; tool input is passed as keyword arguments
+        self._tool_table: Dict[str, Callable[..., Awaitable[Dict]]] = {
+            "read_file": self._read_file,
+        }
+        self.conn = self._open_history_db()
         self.load_history()
 
-    async def _call_claude(self, messages: List[Dict]) -> Tuple[Any, Optional[str]]:
+    @property
+    def client(self) -> AsyncAnthropic:
+        # Built per event loop so the agent keeps working across separate asyncio.run() calls
+        loop = asyncio.get_running_loop()
+        http_client = get_http_client()
+        cached = self._clients.get(loop)
+        if cached is None or cached[0] is not http_client:
+            cached = (http_client, AsyncAnthropic(api_key=self.api_key, http_client=http_client))
+            self._clients[loop] = cached
+        return cached[1]
+
+    @property
+    def _tool_sem(self) -> asyncio.Semaphore:
+        # A semaphore binds to the loop it is first contended on, so keep one per loop like the client
+        loop = asyncio.get_running_loop()
+        sem = self._tool_sems.get(loop)
+        if sem is None:
+            sem = self._tool_sems[loop] = asyncio.Semaphore(self._tool_concurrency)
+        return sem
+
+    @staticmethod
+    def _with_cache_breakpoints(messages: List[Dict], count: int = 2) -> List[Dict]:
+        # Mark the last `count` user turns so the conversation prefix is read from
+        # the prompt cache on the next react-loop iteration
+        marked = list(messages)
+        user_indices = [i for i, msg in enumerate(marked) if msg["role"] == "user"][-count:]
+        for i in user_indices:
+            content = marked[i]["content"]
+            if isinstance(content, str):
+                if not content:
+                    continue
+                blocks = [{"type": "text", "text": content}]
+            elif content and isinstance(content[-1], dict):
+                blocks = list(content)
+            else:
+                continue
+            blocks[-1] = {**blocks[-1], "cache_control": {"type": "ephemeral"}}
+            marked[i] = {**marked[i], "content": blocks}
+        return marked
+
+    async def _call_claude(self, messages: List[Dict],
+                           on_tool_use: Optional[Callable[[Any], None]] = None) -> Tuple[Any, Optional[str]]:
         try:
-            response = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
+            async with self.client.messages.stream(
+                model=MODEL,
                 max_tokens=4000,
-                system=SYSTEM_PROMPT,
-                tools=TOOLS_SCHEMA,
-                messages=messages,
-                temperature=0.7
-            )
+                system=SYSTEM_BLOCKS,
+                tools=TOOLS_SCHEMA_FROZEN,
+                messages=self._with_cache_breakpoints(messages)
+            ) as stream:
+                async for event in stream:
+                    if event.type == "text":
+                        if self.verbose:
+                            print(event.text, end="", flush=True)
+                    elif event.type == "content_block_stop":
+                        if event.content_block.type == "text":
+                            if self.verbose:
+                                print()
+                        elif event.content_block.type == "tool_use" and on_tool_use:
+                            on_tool_use(event.content_block)
+                response = await stream.get_final_message()
             return response.content, None
         except anthropic.APIError as e:
             return None, f"API Error: {str(e)}"
         except Exception as e:
             return None, f"Unexpected error calling Claude API: {str(e)}"
 
+    async def _summarize_history(self, messages: List[Dict]) -> Optional[str]:
+        transcript = "\n\n".join(f"[{msg['role']}] {msg['content']}" for msg in messages)
+        if self.summary:
+            transcript = f"Previous summary:\n{self.summary}\n\nConversation:\n{transcript}"
+        try:
+            response = await self.client.messages.create(
+                model=SUMMARY_MODEL,
+                max_tokens=1000,
+                system=SUMMARY_PROMPT,
+                messages=[{"role": "user", "content": transcript}]
+            )
+        except anthropic.APIError as e:
+            # Only API failures are retried later; anything else is a bug and should surface
+            print(f"Warning: Could not summarize history: {e}")
+            return None
+        return "".join(block.text for block in response.content if block.type == "text")
+
     async def _read_file(self, path: str) -> dict:
-        return await read_file(self.working_directory, path)
+        return await read_file(self.working_directory, path, self._executor)
 
-    async def _execute_tool_calls(self, tool_uses: List[Any]) -> List[Dict]:
-        tool_results = []
-        for tool_use in tool_uses:
-            print(f"   Executing: {tool_use.name}")
+    async def _dispatch_tool(self, tool_use: Any) -> Dict:
+        async with self._tool_sem:
+            handler = self._tool_table.get(tool_use.name)
+            if handler is None:
+                return {"error": f"Unknown tool: {tool_use.name}"}
             try:
-                if tool_use.name == "read_file":
-                    result = await self._read_file(tool_use.input.get("path", ""))
-                # Implement other tool names as needed
-                else:
-                    result = {"error": f"Unknown tool: {tool_use.name}"}
+                return await handler(**tool_use.input)
             except Exception as e:
-                result = {"error": f"Tool execution failed: {str(e)}"}
+                return {"error": f"Tool execution failed: {str(e)}"}
 
+    async def _execute_tool_calls(self, tool_uses: List[Any],
+                                  started: Optional[Dict[str, asyncio.Task]] = None) -> List[Dict]:
+        started = started or {}
+        results = await asyncio.gather(
+            *[started.get(tool_use.id) or self._dispatch_tool(tool_use) for tool_use in tool_uses],
+            return_exceptions=True
+        )
+        tool_results = []
+        log = []
+        for tool_use, result in zip(tool_uses, results):
+            if isinstance(result, BaseException):
+                result = {"error": f"Tool execution failed: {str(result)}"}
+            log.append(f"   Executed: {tool_use.name}")
             if "success" in result and result["success"]:
-                print(f"Tool executed successfully")
+                log.append("Tool executed successfully")
             elif "error" in result:
-                print(f"Error: {result['error']}")
+                log.append(f"Error: {result['error']}")
             tool_results.append({
                 "tool_use_id": tool_use.id,
-                "content": json.dumps(result)
+                "content": orjson.dumps(result).decode()
             })
+        if self.verbose:
+            print("\n".join(log))
         return tool_results
 
-    def save_history(self):
+    def _submit_history_io(self, fn, *args) -> concurrent.futures.Future:
+        future = self._history_executor.submit(fn, *args)
         try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.messages, f, indent=2)
+            asyncio.get_running_loop()
+        except RuntimeError:
+            future.result()
+        return future
+
+    def _open_history_db(self) -> sqlite3.Connection:
+        # Autocommit: every INSERT is its own transaction, so there is nothing left to save
+        conn = sqlite3.connect(self.history_file, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT, content TEXT, ts REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS summary("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), content TEXT, up_to INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings(message_id INTEGER PRIMARY KEY, vector BLOB)"
+        )
+        return conn
+
+    def _append_history(self, messages: List[Dict]):
+        _HISTORY_CACHE.pop(self.history_file, None)
+        try:
+            self.conn.execute("BEGIN")
+            try:
+                ids = [
+                    self.conn.execute(
+                        "INSERT INTO messages(role, content, ts) VALUES (?, ?, ?)",
+                        (msg["role"], msg["content"], msg["timestamp"])
+                    ).lastrowid
+                    for msg in messages
+                ]
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            for msg, msg_id in zip(messages, ids):
+                msg["id"] = msg_id
         except Exception as e:
             print(f"Warning: Could not save history: {e}")
 
+    def _save_summary(self, summary: str, up_to: int):
+        _HISTORY_CACHE.pop(self.history_file, None)
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO summary(id, content, up_to) VALUES (1, ?, ?)",
+                (summary, up_to)
+            )
+        except Exception as e:
+            print(f"Warning: Could not save summary: {e}")
+
+    def _delete_history(self):
+        _HISTORY_CACHE.pop(self.history_file, None)
+        try:
+            self.conn.execute("DELETE FROM messages")
+            self.conn.execute("DELETE FROM summary")
+            self.conn.execute("DELETE FROM embeddings")
+        except Exception as e:
+            print(f"Warning: Could not clear history: {e}")
+
+    def _load_embeddings(self, message_ids: List[int]) -> Dict[int, Any]:
+        placeholders = ", ".join("?" * len(message_ids))
+        rows = self.conn.execute(
+            f"SELECT message_id, vector FROM embeddings WHERE message_id IN ({placeholders})",
+            message_ids
+        ).fetchall()
+        return {msg_id: np.frombuffer(vector, dtype=np.float32) for msg_id, vector in rows}
+
+    def _save_embeddings(self, rows: List[Tuple[int, bytes]]):
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings(message_id, vector) VALUES (?, ?)", rows)
+        except Exception as e:
+            print(f"Warning: Could not save embeddings: {e}")
+
+    def _history_stamp(self) -> Tuple:
+        # WAL writes only touch the -wal file until a checkpoint, so both files count;
+        # an empty or missing -wal holds no data and is treated the same
+        stamp = []
+        for path in (self.history_file, self.history_file + "-wal"):
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+                continue
+            stamp.append((st.st_mtime_ns, st.st_size) if st.st_size else None)
+        return tuple(stamp)
+
     def load_history(self):
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    self.messages = json.load(f)
+            stamp = self._history_stamp()
+            cached = _HISTORY_CACHE.get(self.history_file)
+            if cached and cached[0] == stamp and cached[1] == self.history_window:
+                _, _, messages, self.summary, self.summarized_up_to = cached
+                self.messages = deque(messages, maxlen=self.history_window)
+            else:
+                rows = self.conn.execute(
+                    "SELECT id, role, content, ts FROM messages ORDER BY id DESC LIMIT ?",
+                    (self.history_window,)
+                ).fetchall()
+                self.messages = deque(
+                    ({"id": msg_id, "role": role, "content": content, "timestamp": ts}
+                     for msg_id, role, content, ts in reversed(rows)),
+                    maxlen=self.history_window
+                )
+                row = self.conn.execute("SELECT content, up_to FROM summary WHERE id = 1").fetchone()
+                if row:
+                    self.summary, self.summarized_up_to = row
+                if stamp[0] is not None:
+                    _HISTORY_CACHE[self.history_file] = (
+                        stamp, self.history_window, list(self.messages), self.summary, self.summarized_up_to
+                    )
         except Exception:
-            self.messages = []
+            self.messages = deque(maxlen=self.history_window)
+
+    def clear_history(self):
+        self.messages.clear()
+        self.summary = None
+        self.summarized_up_to = 0
+        self._summary_retry_id = 0
+        self._pending = []
+        self._embeddings = {}
+        self._submit_history_io(self._delete_history)
 
     def add_message(self, role: str, content: str):
-        self.messages.append({"role": role, "content": content})
-        self.save_history()
+        # The id is assigned by SQLite when the message is flushed, so agents sharing a database never collide
+        message = {"id": None, "role": role, "content": content, "timestamp": time.time()}
+        self.messages.append(message)
+        self._pending.append(message)
+        self._ensure_flush_task()
+
+    def _ensure_flush_task(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_history()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(HISTORY_FLUSH_DELAY)
+        self._flush_pending()
+
+    def _flush_pending(self) -> Optional[concurrent.futures.Future]:
+        if not self._pending:
+            return None
+        messages, self._pending = self._pending, []
+        return self._submit_history_io(self._append_history, messages)
+
+    def flush_history(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        future = self._flush_pending()
+        if future is not None:
+            future.result()
+
+    def _close_history_db(self):
+        try:
+            self.conn.execute("PRAGMA optimize")
+        finally:
+            self.conn.close()
+
+    def close(self):
+        self.flush_history()
+        self._history_executor.submit(self._close_history_db).result()
+        self._history_executor.shutdown()
+        self._executor.shutdown()
+
+    def _select_history(self, history: List[Dict], budget_bytes: int, keep_recent: int) -> List[Dict]:
+        # Greedy knapsack: the most recent messages are always kept, the rest are
+        # retained by weight per byte until the budget is spent
+        split = max(0, len(history) - keep_recent)
+        sizes = [len(orjson.dumps(msg.get("content"))) for msg in history]
+        used = sum(sizes[split:])
+        selected = list(range(split, len(history)))
+        ranked = sorted(
+            range(split),
+            key=lambda i: HISTORY_WEIGHTS.get(history[i].get("role"), 1.0) / max(sizes[i], 1),
+            reverse=True
+        )
+        for i in ranked:
+            if used + sizes[i] <= budget_bytes:
+                used += sizes[i]
+                selected.append(i)
+        return [history[i] for i in sorted(selected)]
+
+    def _encode(self, texts: List[str]) -> Any:
+        if self._embedder is None:
+            self._embedder = SentenceTransformer(EMBEDDING_MODEL)
+        return self._embedder.encode(texts, normalize_embeddings=True).astype(np.float32)
+
+    async def _retain_relevant(self, history: List[Dict], query: str, count: int) -> List[Dict]:
+        # Keep the `count` messages most similar to the query, with a small bonus for recency
+        if any(msg["id"] is None for msg in history):
+            return history[-count:]
+        try:
+            missing = [msg["id"] for msg in history if msg["id"] not in self._embeddings]
+            if missing:
+                stored = self._history_executor.submit(self._load_embeddings, missing)
+                self._embeddings.update(await asyncio.wrap_future(stored))
+            missing_msgs = [msg for msg in history if msg["id"] not in self._embeddings]
+            texts = [str(msg["content"]) for msg in missing_msgs] + [query]
+            vectors = await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, texts)
+            for msg, vector in zip(missing_msgs, vectors[:-1]):
+                self._embeddings[msg["id"]] = vector
+            # Drop vectors for messages that have left the window or been summarized
+            self._embeddings = {msg["id"]: self._embeddings[msg["id"]] for msg in history}
+            if missing_msgs:
+                rows = [(msg["id"], self._embeddings[msg["id"]].tobytes()) for msg in missing_msgs]
+                self._submit_history_io(self._save_embeddings, rows)
+        except Exception as e:
+            print(f"Warning: Could not rank history by relevance: {e}")
+            return history
+        sims = np.stack([self._embeddings[msg["id"]] for msg in history]) @ vectors[-1]
+        scores = sims + RECENCY_WEIGHT * np.linspace(0, 1, len(history))
+        keep = np.sort(np.argsort(-scores)[:count])
+        return [history[i] for i in keep]
 
-    def build_messages_list(self, user_input: Optional[str] = None,
-                            tool_results: Optional[List[Dict]] = None,
-                            assistant_content: Optional[Any] = None,
-                            max_history: int = 20) -> List[Dict]:
+    async def build_messages_list(self, user_input: Optional[str] = None,
+                                  tool_results: Optional[List[Dict]] = None,
+                                  assistant_content: Optional[Any] = None,
+                                  max_history: int = 20,
+                                  summarize_after: int = 40,
+                                  budget_bytes: int = 32 * 1024,
+                                  keep_recent: int = 6) -> List[Dict]:
+        # Write queued messages first so every message here has its database id; the writer
+        # runs jobs in order, so waiting on a no-op also waits for flushes already in flight
+        self._flush_pending()
+        await asyncio.wrap_future(self._history_executor.submit(lambda: None))
+        # A message whose write failed has no id; it is kept as unsummarized
+        unsummarized = [msg for msg in self.messages if msg["id"] is None or msg["id"] > self.summarized_up_to]
+        last_id = max((msg["id"] for msg in unsummarized if msg["id"] is not None), default=0)
+        if len(unsummarized) > summarize_after and last_id >= self._summary_retry_id:
+            older = unsummarized[:-max_history]
+            boundary = max((msg["id"] for msg in older if msg["id"] is not None), default=0)
+            summary = await self._summarize_history(older) if boundary else None
+            if summary:
+                self.summary = summary
+                self.summarized_up_to = boundary
+                self._submit_history_io(self._save_summary, self.summary, self.summarized_up_to)
+                unsummarized = unsummarized[-max_history:]
+            else:
+                self._summary_retry_id = last_id + max_history
+        if user_input and SentenceTransformer is not None and len(unsummarized) > max_history:
+            # The latest turns are always kept; only older messages compete on relevance
+            split = len(unsummarized) - keep_recent
+            slots = max_history - keep_recent
+            if slots > 0:
+                older = await self._retain_relevant(unsummarized[:split], user_input, slots)
+            else:
+                older = []
+            unsummarized = older + unsummarized[split:][-max_history:]
         messages = []
-        start_idx = max(0, len(self.messages) - max_history)
-        for msg in self.messages[start_idx:]:
+        if self.summary:
+            messages.append({"role": "assistant", "content": f"[Summary of earlier conversation: {self.summary}]"})
+        for msg in self._select_history(unsummarized, budget_bytes, keep_recent):
             if isinstance(msg, dict) and "role" in msg and "content" in msg:
                 messages.append({"role": msg["role"], "content": msg["content"]})
         if user_input:
@@ -99,15 +503,27 @@ class CodingAgent:
         return messages
 
     async def react_loop(self, user_input: str) -> str:
+        # History is trimmed once per turn; tool rounds are appended to it below
+        messages = await self.build_messages_list(user_input=user_input)
         self.add_message("user", user_input)
-        messages = self.build_messages_list(user_input=user_input)
         last_complete_response = None
         safety_limit = 20
         iterations = 0
+        prev_hash = None
+        looped = False
         while iterations < safety_limit:
             iterations += 1
-            content_blocks, error = await self._call_claude(messages)
+            # Tools start as soon as their block finishes streaming, before the rest of the response
+            started: Dict[str, asyncio.Task] = {}
+
+            def start_tool(tool_use: Any):
+                if tool_use.id not in started:
+                    started[tool_use.id] = asyncio.create_task(self._dispatch_tool(tool_use))
+
+            content_blocks, error = await self._call_claude(messages, on_tool_use=start_tool)
             if error:
+                for task in started.values():
+                    task.cancel()
                 error_msg = f"Error: {error}"
                 self.add_message("assistant", error_msg)
                 return error_msg
@@ -116,13 +532,31 @@ class CodingAgent:
                 last_complete_response = "\n".join(text_responses)
             if not tool_uses:
                 break
-            tool_results = await self._execute_tool_calls(tool_uses)
-            messages = self.build_messages_list(
-                assistant_content=content_blocks,
-                tool_results=tool_results
-            )
+            # Same text and tool calls as the previous round: Claude is looping, stop here
+            response_hash = hash(tuple(
+                (block.type, getattr(block, "text", None) or getattr(block, "name", None),
+                 orjson.dumps(getattr(block, "input", None), option=orjson.OPT_SORT_KEYS))
+                for block in content_blocks
+            ))
+            if response_hash == prev_hash:
+                for task in started.values():
+                    task.cancel()
+                looped = True
+                break
+            prev_hash = response_hash
+            tool_results = await self._execute_tool_calls(tool_uses, started)
+            messages.append({"role": "assistant", "content": content_blocks})
+            messages.append({
+                "role": "user",
+                "content": [
+                    {"type": "tool_result", "tool_use_id": tr["tool_use_id"], "content": tr["content"]}
+                    for tr in tool_results
+                ]
+            })
         if not last_complete_response:
             final_response = "I couldn't generate a response."
+        elif looped:
+            final_response = f"{last_complete_response}\n\n(Note: stopped because the same tool calls repeated.)"
         elif iterations >= safety_limit:
             final_response = f"{last_complete_response}\n\n(Note: I reached my processing limit. You may want to break this down into smaller steps.)"
         else:
@@ -138,6 +572,44 @@ class CodingAgent:
             error_msg = f"Unexpected error processing message: {str(e)}"
             self.add_message("assistant", error_msg)
             return error_msg
+        finally:
+            self.flush_history()
+
+    async def process_batch(self, inputs: List[str], poll_interval: float = 5.0,
+                            max_poll_interval: float = 60.0) -> List[str]:
+        # One-shot answers through the Message Batches API: no tools and no history,
+        # at half the price, but results can take minutes to arrive
+        requests = [
+            {
+                "custom_id": f"input-{i}",
+                "params": {
+                    "model": MODEL,
+                    "max_tokens": 4000,
+                    "system": SYSTEM_BLOCKS,
+                    "messages": [{"role": "user", "content": text}]
+                }
+            }
+            for i, text in enumerate(inputs)
+        ]
+        try:
+            batch = await self.client.messages.batches.create(requests=requests)
+            delay = poll_interval
+            while batch.processing_status != "ended":
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_poll_interval)
+                batch = await self.client.messages.batches.retrieve(batch.id)
+            responses = {}
+            async for entry in await self.client.messages.batches.results(batch.id):
+                if entry.result.type == "succeeded":
+                    text_responses, _ = self._parse_claude_response(entry.result.message.content)
+                    responses[entry.custom_id] = "\n".join(text_responses)
+                else:
+                    responses[entry.custom_id] = f"Error: batch request {entry.result.type}"
+        except anthropic.APIError as e:
+            return [f"Error: API Error: {str(e)}"] * len(inputs)
+        except Exception as e:
+            return [f"Error: Unexpected error calling Claude API: {str(e)}"] * len(inputs)
+        return [responses.get(f"input-{i}", "Error: no result returned") for i in range(len(inputs))]
 
     def _parse_claude_response(self, content_blocks: Any) -> Tuple[List[str], List[Any]]:
         text_responses = []
@@ -145,8 +617,8 @@ class CodingAgent:
         for block in content_blocks:
             if block.type == "text":
                 text_responses.append(block.text)
-                print(f" {block.text}")
             elif block.type == "tool_use":
                 tool_uses.append(block)
-                print(f" Tool call: {block.name}")
+        if self.verbose and tool_uses:
+            print("\n".join(f" Tool call: {tool_use.name}" for tool_use in tool_uses))
         return text_responses, tool_uses
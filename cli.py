@@ -1,21 +1,29 @@
 import os
-from agent import CodingAgent
+import argparse
+import orjson
+from itertools import islice
+from agent import CodingAgent, close_http_client
 from dotenv import load_dotenv
 import asyncio
 
 load_dotenv()
 
-async def main():
+async def run_batch(agent: CodingAgent, path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        inputs = [line.strip() for line in f if line.strip()]
+    if not inputs:
+        print(f"No prompts found in {path}, nothing to submit.")
+        return
+    print(f"Submitting {len(inputs)} prompts as a batch, this can take several minutes...")
+    responses = await agent.process_batch(inputs)
+    for user_input, response in zip(inputs, responses):
+        print(f"\n You: {user_input}\n Agent: {response}")
+
+async def chat(agent: CodingAgent):
     print("Welcome to Baby Claude Code!!")
     print("Type 'exit' or 'quit' to quit, 'clear' to clear history, 'history' to show recent messages")
     print("-" * 50)
 
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        api_key = input("Enter your Anthropic API key: ").strip()
-
-    agent = CodingAgent(api_key)
-
     while True:
         try:
             user_input = input("\n You: ").strip()
@@ -23,19 +31,17 @@ async def main():
                 print("Goodbye!")
                 break
             elif user_input.lower() == 'clear':
-                agent.messages = []
-                agent.save_history()
+                agent.clear_history()
                 print("History cleared!")
                 continue
             elif user_input.lower() == 'history':
                 print("\nRecent conversation history:")
-                for msg in agent.messages[-10:]:
+                for msg in islice(agent.messages, max(0, len(agent.messages) - 10), None):
                     role = msg.get("role", "unknown")
                     content = msg.get("content", "")
-                    if len(content) > 100:
-                        content = content[:100] + "..."
-                    timestamp = msg.get("timestamp", "")
-                    print(f"  [{role}] {content}")
+                    if not isinstance(content, str):
+                        content = orjson.dumps(content).decode()
+                    print(f"  [{role}] {content[:100]}{'...' if len(content) > 100 else ''}")
                 continue
             elif not user_input:
                 continue
@@ -48,5 +54,27 @@ async def main():
         except Exception as e:
             print(f"\n Error: {e}")
 
+async def main():
+    parser = argparse.ArgumentParser(description="Baby Claude Code")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="answer each line of FILE through the Message Batches API instead of chatting")
+    parser.add_argument("--verbose", action="store_true",
+                        help="stream Claude's text and tool activity while a message is processed")
+    args = parser.parse_args()
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        api_key = input("Enter your Anthropic API key: ").strip()
+
+    agent = CodingAgent(api_key, verbose=args.verbose)
+    try:
+        if args.batch:
+            await run_batch(agent, args.batch)
+        else:
+            await chat(agent)
+    finally:
+        agent.close()
+        await close_http_client()
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,3 +1,5 @@
+from types import MappingProxyType
+
 SYSTEM_PROMPT = """You are a helpful coding agent that assists with programming tasks and file operations.
 
 When responding to requests:
@@ -19,6 +21,23 @@ After receiving tool results:
 
 Be concise and efficient. Complete the requested task and stop."""
 
+# Wire-format system prompt with its cache breakpoint, built once at import
+SYSTEM_BLOCKS = (
+    MappingProxyType({"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}),
+)
+
+
+MODEL = "claude-sonnet-4-6"
+
+SUMMARY_MODEL = "claude-haiku-4-5"
+
+# Local sentence-transformers model used to pick relevant history, if installed
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+SUMMARY_PROMPT = """Summarize the conversation below between a user and a coding agent.
+Keep the user's goals and corrections, decisions made, files touched and any open tasks.
+Be concise: a few short paragraphs at most. If a previous summary is given, fold it into the new one."""
+
 
 TOOLS_SCHEMA = [
     {
@@ -33,4 +52,10 @@ TOOLS_SCHEMA = [
         }
     },
     # Other tool definitions...
-]
\ No newline at end of file
+]
+
+# A cache breakpoint on the last tool caches the whole tool block
+TOOLS_SCHEMA[-1]["cache_control"] = {"type": "ephemeral"}
+
+# Read-only view of the tool definitions passed on every request
+TOOLS_SCHEMA_FROZEN = tuple(MappingProxyType(tool) for tool in TOOLS_SCHEMA)
@@ -1,13 +1,15 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from concurrent.futures import Executor
 from pathlib import Path
+import asyncio
 
-async def read_file(working_directory: Path, path: str) -> Dict[str, Any]:
+async def read_file(working_directory: Path, path: str, executor: Optional[Executor] = None) -> Dict[str, Any]:
     try:
         file_path = (working_directory / path).resolve()
-        if not str(file_path).startswith(str(working_directory)):
+        if not file_path.is_relative_to(working_directory):
             return {"error": "Access denied: path outside working directory"}
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(executor, file_path.read_text, 'utf-8')
         return {"success": True, "content": content, "path": str(file_path)}
     except Exception as e:
         return {"error": f"Could not read file: {str(e)}"}